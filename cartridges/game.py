@@ -54,13 +54,16 @@ class Game(Gtk.Box):
     source: str
     hidden: bool = False
     last_played: int = 0
-    name: str
-    developer: Optional[str] = None
+    sort_name: str
+    search_key: str
     removed: bool = False
     blacklisted: bool = False
     game_cover: GameCover = None
     version: int = 0
 
+    _name: str = ""
+    _developer: Optional[str] = None
+
     def __init__(self, data: dict[str, Any], **kwargs: Any) -> None:
         super().__init__(**kwargs)
 
@@ -81,6 +84,30 @@ class Game(Gtk.Box):
 
         shared.schema.connect("changed", self.schema_changed)
 
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @name.setter
+    def name(self, name: str) -> None:
+        self._name = name
+        # Cached for sorting, which compares names O(n log n) times
+        self.sort_name = name.casefold().removeprefix("the ")
+        self.__update_search_key()
+
+    @property
+    def developer(self) -> Optional[str]:
+        return self._developer
+
+    @developer.setter
+    def developer(self, developer: Optional[str]) -> None:
+        self._developer = developer
+        self.__update_search_key()
+
+    def __update_search_key(self) -> None:
+        # Searched on every keystroke, the separator keeps matches within a field
+        self.search_key = f"{self._name}\0{self._developer or ''}".casefold()
+
     def update_values(self, data: dict[str, Any]) -> None:
         for key, value in data.items():
             # Convert executables to strings
@@ -17,11 +17,17 @@
 #
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+import json
+import logging
 import os
+import re
 import shlex
+import shutil
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from functools import cache, lru_cache
 from pathlib import Path
-from typing import NamedTuple
+from typing import Any, NamedTuple, Optional
 
 from gi.repository import GLib, Gtk
 
@@ -30,178 +36,353 @@ from cartridges.game import Game
 from cartridges.importer.source import Source, SourceIterable
 
 
-class DesktopSourceIterable(SourceIterable):
-    source: "DesktopSource"
+_DESKTOP_KEYS = ("Categories", "Name", "Exec", "TryExec", "NoDisplay", "Hidden", "Icon")
 
-    def __iter__(self):
-        """Generator method producing games"""
+_DESKTOP_RE = re.compile(
+    rf"^[ \t]*({'|'.join(_DESKTOP_KEYS)})[ \t]*=[ \t]*([^\r\n]*)", re.MULTILINE
+)
+# Like GLib.KeyFile, ignore leading whitespace on every line
+_GROUP_RE = re.compile(r"^[ \t]*\[Desktop Entry\][ \t]*\r?$", re.MULTILINE)
+_NEXT_GROUP_RE = re.compile(r"^[ \t]*\[", re.MULTILINE)
+# Launch commands of games imported by other sources
+_SKIPPED_MARKERS = (b"steam://rungameid/", b"heroic://launch/", b"bottles-cli ")
 
-        icon_theme = Gtk.IconTheme.new()
+_ESCAPE_RE = re.compile(r"\\(.)")
+_ESCAPES = {"s": " ", "n": "\n", "t": "\t", "r": "\r", "\\": "\\"}
 
-        search_paths = [
-            shared.host_data_dir,
-            "/run/host/usr/local/share",
-            "/run/host/usr/share",
-            "/run/host/usr/share/pixmaps",
-            "/usr/share/pixmaps",
-        ] + GLib.get_system_data_dirs()
 
-        for search_path in search_paths:
-            path = Path(search_path)
+def _unescape(value: str) -> str:
+    return _ESCAPE_RE.sub(lambda match: _ESCAPES.get(match[1], match[0]), value)
 
-            if not str(search_path).endswith("/pixmaps"):
-                path = path / "icons"
 
-            if not path.is_dir():
-                continue
+def _read_desktop_entry(raw: bytes) -> Optional[dict[str, str]]:
+    """
+    Read the keys needed for import from the main group of a desktop entry.
+    Only files that are not valid UTF-8 go through `GLib.KeyFile`.
+    """
+    try:
+        text = raw.decode("utf-8")
+    except UnicodeDecodeError:
+        return _read_desktop_entry_keyfile(raw)
 
-            if str(path).startswith("/app/"):
-                continue
+    if not (group := _GROUP_RE.search(text)):
+        return None
 
-            icon_theme.add_search_path(str(path))
+    section = text[group.end() :]
+    if next_group := _NEXT_GROUP_RE.search(section):
+        section = section[: next_group.start()]
 
-        launch_command, full_path = self.check_launch_commands()
+    return {key: _unescape(value) for key, value in _DESKTOP_RE.findall(section)}
 
-        for path in search_paths:
-            if str(path).startswith("/app/"):
-                continue
 
-            path = Path(path) / "applications"
+def _read_desktop_entry_keyfile(raw: bytes) -> Optional[dict[str, str]]:
+    keyfile = GLib.KeyFile.new()
 
-            if not path.is_dir():
-                continue
+    try:
+        keyfile.load_from_bytes(GLib.Bytes.new(raw), 0)
+    except GLib.Error:
+        return None
 
-            for entry in path.iterdir():
-                if entry.suffix != ".desktop":
-                    continue
+    fields = {}
+    for key in _DESKTOP_KEYS:
+        try:
+            fields[key] = keyfile.get_string("Desktop Entry", key)
+        except GLib.Error:
+            pass
 
-                # Skip Lutris games
-                if str(entry.name).startswith("net.lutris."):
-                    continue
+    return fields
 
-                keyfile = GLib.KeyFile.new()
 
-                try:
-                    keyfile.load_from_file(str(entry), 0)
+def _run_command(*args: str) -> bool:
+    """Run a command on the host and return whether it succeeded"""
+    if os.getenv("FLATPAK_ID") == shared.APP_ID:
+        args = ("flatpak-spawn", "--host", *args)
 
-                    if "Game" not in keyfile.get_string_list(
-                        "Desktop Entry", "Categories"
-                    ):
-                        continue
+    try:
+        subprocess.run(args, capture_output=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return False
 
-                    name = keyfile.get_string("Desktop Entry", "Name")
-                    executable = keyfile.get_string("Desktop Entry", "Exec").split(
-                        " %"
-                    )[0]
-                except GLib.Error:
-                    continue
+    return True
 
-                try:
-                    try_exec = "which " + keyfile.get_string("Desktop Entry", "TryExec")
-                    if not self.check_command(try_exec):
-                        continue
 
-                except GLib.Error:
-                    pass
+def _command_exists(command: str) -> bool:
+    """Check whether a command is available on the host"""
+    if os.getenv("FLATPAK_ID") == shared.APP_ID:
+        return _run_command("which", command)
 
-                # Skip Steam games
-                if "steam://rungameid/" in executable:
-                    continue
+    return bool(shutil.which(command))
+
+
+@lru_cache(maxsize=1)
+def _detect_launch_command() -> tuple[str, bool]:
+    """Check whether `gio launch` `gtk4-launch` or `gtk-launch` are available on the system"""
+
+    # Even if `gio` is available, `gio launch` is only available on GLib >= 2.67.2
+    if _run_command("gio", "help", "launch"):
+        return "gio launch", True
+
+    if _command_exists("gtk4-launch"):
+        return "gtk4-launch", False
+
+    return "gtk-launch", False
+
+
+@cache
+def _get_search_paths() -> tuple[str, ...]:
+    """Get the existing data directories that may contain desktop entries or icons"""
+    return tuple(
+        path
+        for path in (
+            os.fspath(shared.host_data_dir),
+            "/run/host/usr/local/share",
+            "/run/host/usr/share",
+            "/run/host/usr/share/pixmaps",
+            "/usr/share/pixmaps",
+            *GLib.get_system_data_dirs(),
+        )
+        if not path.startswith("/app/") and os.path.isdir(path)
+    )
+
+
+def _get_icon_cache_key(
+    icon_dirs: set[str], direction: Gtk.TextDirection
+) -> Optional[list]:
+    """
+    Get what icon lookups depend on: the text direction and the modification
+    times of the icon directories and the themes directly in them.
+    Installing icons and updating a theme's icon cache changes the latter.
+    Returns `None` if a directory can't be read.
+    """
+    key: list = [int(direction)]
+
+    try:
+        for icon_dir in sorted(icon_dirs):
+            key.append([icon_dir, os.stat(icon_dir).st_mtime_ns])
+
+            with os.scandir(icon_dir) as iterator:
+                key.extend(
+                    [entry.path, entry.stat().st_mtime_ns]
+                    for entry in iterator
+                    if entry.is_dir()
+                )
+    except OSError as error:
+        logging.debug("Not using the desktop icon cache: %s", error)
+        return None
+
+    return key
+
+
+def _load_icon_cache(key: list) -> dict[str, Optional[str]]:
+    """Load the icon lookups of a previous run if they are still valid"""
+    try:
+        with (shared.cache_dir / "cartridges" / "desktop_icons.json").open(
+            encoding="utf-8"
+        ) as open_file:
+            cache = json.load(open_file)
+    except (OSError, ValueError):
+        return {}
+
+    if not isinstance(cache, dict) or cache.get("key") != key:
+        return {}
+
+    return {name: path for name, path in cache.get("icons", {}).items() if path}
+
+
+def _save_icon_cache(key: list, icons: dict[str, Optional[str]]) -> None:
+    """Save the icons that were found, misses may be installed into any subdir later"""
+    cache_path = shared.cache_dir / "cartridges" / "desktop_icons.json"
+    tmp_path = cache_path.with_suffix(".json.tmp")
+
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        with tmp_path.open("w", encoding="utf-8") as open_file:
+            json.dump(
+                {
+                    "key": key,
+                    "icons": {name: path for name, path in icons.items() if path},
+                },
+                open_file,
+            )
+        os.replace(tmp_path, cache_path)
+    except OSError as error:
+        logging.warning("Couldn't save the desktop icon cache: %s", error)
 
-                # Skip Heroic games
-                if "heroic://launch/" in executable:
-                    continue
 
-                # Skip Bottles games
-                if "bottles-cli " in executable:
+class DesktopSourceIterable(SourceIterable):
+    source: "DesktopSource"
+
+    def __iter__(self):
+        """Generator method producing games"""
+
+        icon_theme = Gtk.IconTheme.new()
+        direction = shared.win.get_direction()
+
+        launch_command, full_path = _detect_launch_command()
+
+        icon_dirs = set()
+        entries = []
+        for search_path in _get_search_paths():
+            if search_path.endswith("/pixmaps"):
+                icon_dir = os.path.realpath(search_path)
+            else:
+                icon_dir = os.path.realpath(os.path.join(search_path, "icons"))
+
+                applications_path = os.path.join(search_path, "applications")
+                if os.path.isdir(applications_path):
+                    with os.scandir(applications_path) as iterator:
+                        entries.extend(
+                            entry
+                            for entry in iterator
+                            if entry.name.endswith(".desktop")
+                        )
+
+            # System data dirs often resolve to the same directories
+            if icon_dir in icon_dirs or not os.path.isdir(icon_dir):
+                continue
+
+            icon_dirs.add(icon_dir)
+            icon_theme.add_search_path(icon_dir)
+
+        # Icon lookups are kept across runs until an icon directory changes
+        icon_cache_key = _get_icon_cache_key(icon_dirs, direction)
+        icon_cache = _load_icon_cache(icon_cache_key) if icon_cache_key else {}
+        n_cached_icons = len(icon_cache)  # Only found icons are cached
+
+        # Parsing is I/O-bound, so entries are read in parallel and games are
+        # created on this thread. Results are kept in search path order, as the
+        # store keeps the first game with a given ID: user entries override
+        # system ones.
+        with ThreadPoolExecutor(
+            max_workers=min(32, (os.cpu_count() or 1) * 4)
+        ) as executor:
+            for result in executor.map(
+                lambda entry: self._try_parse_entry(entry, launch_command, full_path),
+                entries,
+            ):
+                if not result:
                     continue
 
-                try:
-                    if keyfile.get_boolean("Desktop Entry", "NoDisplay"):
-                        continue
-                except GLib.Error:
-                    pass
-
-                try:
-                    if keyfile.get_boolean("Desktop Entry", "Hidden"):
-                        continue
-                except GLib.Error:
-                    pass
-
-                # Strip /run/host from Flatpak paths
-                if entry.is_relative_to(prefix := "/run/host"):
-                    entry = Path("/") / entry.relative_to(prefix)
-
-                launch_arg = shlex.quote(str(entry if full_path else entry.stem))
-
-                values = {
-                    "source": self.source.source_id,
-                    "added": shared.import_time,
-                    "name": name,
-                    "game_id": f"desktop_{entry.stem}",
-                    "executable": f"{launch_command} {launch_arg}",
-                }
+                values, icon_str = result
                 game = Game(values)
 
-                additional_data = {}
-
-                try:
-                    icon_str = keyfile.get_string("Desktop Entry", "Icon")
-                except GLib.Error:
+                if icon_str is None:
                     yield game
                     continue
-                else:
-                    if "/" in icon_str:
-                        additional_data = {"local_icon_path": Path(icon_str)}
-                        yield (game, additional_data)
-                        continue
-
-                try:
-                    if (
-                        icon_path := icon_theme.lookup_icon(
-                            icon_str,
-                            None,
-                            512,
-                            1,
-                            shared.win.get_direction(),
-                            0,
-                        )
-                        .get_file()
-                        .get_path()
-                    ):
-                        additional_data = {"local_icon_path": Path(icon_path)}
-                except GLib.Error:
-                    pass
+
+                # Many entries share generic icon names
+                if icon_str not in icon_cache:
+                    icon_cache[icon_str] = self._lookup_icon(
+                        icon_theme, icon_str, direction
+                    )
+
+                additional_data = {}
+                if icon_path := icon_cache[icon_str]:
+                    additional_data = {"local_icon_path": Path(icon_path)}
 
                 yield (game, additional_data)
 
-    def check_command(self, command) -> bool:
-        flatpak_str = "flatpak-spawn --host /bin/sh -c "
+        if icon_cache_key and (
+            sum(1 for path in icon_cache.values() if path) != n_cached_icons
+        ):
+            _save_icon_cache(icon_cache_key, icon_cache)
 
-        if os.getenv("FLATPAK_ID") == shared.APP_ID:
-            command = flatpak_str + shlex.quote(command)
+    def _lookup_icon(
+        self,
+        icon_theme: Gtk.IconTheme,
+        icon_str: str,
+        direction: Gtk.TextDirection,
+    ) -> Optional[str]:
+        if "/" in icon_str:
+            return icon_str
 
         try:
-            subprocess.run(command, shell=True, check=True)
-        except subprocess.CalledProcessError:
-            return False
+            if (
+                icon_path := icon_theme.lookup_icon(
+                    icon_str,
+                    None,
+                    512,
+                    1,
+                    direction,
+                    0,
+                )
+                .get_file()
+                .get_path()
+            ):
+                return icon_path
+        except GLib.Error:
+            pass
+
+        return None
+
+    def _try_parse_entry(
+        self, entry: os.DirEntry, launch_command: str, full_path: bool
+    ) -> Optional[tuple[dict[str, Any], Optional[str]]]:
+        # A single broken entry shouldn't stop the others from importing
+        try:
+            return self._parse_entry(entry, launch_command, full_path)
+        except Exception as error:  # pylint: disable=broad-exception-caught
+            logging.exception(
+                "%s while parsing desktop entry %s", type(error).__name__, entry.path
+            )
+            return None
 
-        return True
+    def _parse_entry(
+        self, entry: os.DirEntry, launch_command: str, full_path: bool
+    ) -> Optional[tuple[dict[str, Any], Optional[str]]]:
+        """Parse a desktop entry, return the game's values and its icon if it is one"""
 
-    def check_launch_commands(self) -> (str, bool):
-        """Check whether `gio launch` `gtk4-launch` or `gtk-launch` are available on the system"""
-        commands = (("gio launch", True), ("gtk4-launch", False), ("gtk-launch", False))
+        # Skip Lutris games
+        if entry.name.startswith("net.lutris."):
+            return None
 
-        for command, full_path in commands:
-            # Even if `gio` is available, `gio launch` is only available on GLib >= 2.67.2
-            command_to_check = (
-                "gio help launch" if command == "gio launch" else f"which {command}"
-            )
+        try:
+            with open(entry.path, "rb") as file:
+                raw = file.read()
+        except OSError:
+            return None
+
+        # Skip Steam, Heroic and Bottles games without parsing the file
+        if any(marker in raw for marker in _SKIPPED_MARKERS):
+            return None
+
+        if not (fields := _read_desktop_entry(raw)):
+            return None
+
+        if "Game" not in fields.get("Categories", "").split(";"):
+            return None
+
+        if "Name" not in fields or "Exec" not in fields:
+            return None
+
+        if (try_exec := fields.get("TryExec")) and not _command_exists(try_exec):
+            return None
+
+        # GLib ignores trailing whitespace in booleans
+        if fields.get("NoDisplay", "").strip() in ("true", "1"):
+            return None
+
+        if fields.get("Hidden", "").strip() in ("true", "1"):
+            return None
+
+        stem = entry.name.removesuffix(".desktop")
+
+        # Strip /run/host from Flatpak paths
+        path = entry.path
+        if path.startswith("/run/host/"):
+            path = path.removeprefix("/run/host")
+
+        launch_arg = shlex.quote(path if full_path else stem)
 
-            if self.check_command(command_to_check):
-                return command, full_path
+        values = {
+            "source": self.source.source_id,
+            "added": shared.import_time,
+            "name": fields["Name"],
+            "game_id": f"desktop_{stem}",
+            "executable": f"{launch_command} {launch_arg}",
+        }
 
-        return commands[2]
+        return values, fields.get("Icon")
 
 
 class DesktopLocations(NamedTuple):
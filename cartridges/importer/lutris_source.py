@@ -18,7 +18,7 @@
 #
 # SPDX-License-Identifier: GPL-3.0-or-later
 from shutil import rmtree
-from sqlite3 import connect
+from sqlite3 import Row, connect
 from typing import NamedTuple
 
 from cartridges import shared
@@ -34,8 +34,16 @@ class LutrisSourceIterable(SourceIterable):
     def __iter__(self):
         """Generator method producing games"""
 
+        # Leave out the runners that aren't imported instead of binding the
+        # settings as parameters, so SQLite doesn't evaluate them for each row
+        runner_filters = "".join(
+            f'AND games.runner IS NOT "{runner}"\n'
+            for runner in ("steam", "flatpak")
+            if not shared.schema.get_boolean(f"lutris-import-{runner}")
+        )
+
         # Query the database
-        request = """
+        request = f"""
             SELECT
                 games.id,
                 games.name,
@@ -53,41 +61,42 @@ class LutrisSourceIterable(SourceIterable):
                 AND games.slug IS NOT NULL
                 AND games.configPath IS NOT NULL
                 AND games.installed
-                AND (games.runner IS NOT "steam" OR :import_steam)
-                AND (games.runner IS NOT "flatpak" OR :import_flatpak)
+                {runner_filters}
             ;
         """
 
-        params = {
-            "import_steam": shared.schema.get_boolean("lutris-import-steam"),
-            "import_flatpak": shared.schema.get_boolean("lutris-import-flatpak"),
-        }
         db_path = copy_db(self.source.locations.data["pga.db"])
         connection = connect(db_path)
-        cursor = connection.execute(request, params)
+        connection.row_factory = Row
+        # The joins may need temporary b-trees, keep them off the disk
+        connection.execute("PRAGMA temp_store = MEMORY")
+        cursor = connection.execute(request)
         coverart_is_dir = (
             coverart_path := self.source.locations.data.root / "coverart"
         ).is_dir()
 
+        # These are the same for every game
+        source_id = self.source.source_id
+        format_game_id = self.source.game_id_format.format
+        format_executable = self.source.executable_format.format
+
         # Create games from the DB results
         for row in cursor:
             # Create game
             values = {
                 "added": shared.import_time,
-                "hidden": row[4],
-                "name": row[1],
-                "source": f"{self.source.source_id}_{row[3]}",
-                "game_id": self.source.game_id_format.format(
-                    runner=row[3], game_id=row[0]
-                ),
-                "executable": self.source.make_executable(game_id=row[0]),
+                "hidden": row["hidden"],
+                "name": row["name"],
+                "source": f"{source_id}_{row['runner']}",
+                "game_id": format_game_id(runner=row["runner"], game_id=row["id"]),
+                "executable": format_executable(game_id=row["id"]),
             }
             game = Game(values)
             additional_data = {}
 
             # Get official image path
             if coverart_is_dir:
-                image_path = coverart_path / f"{row[2]}.jpg"
+                image_path = coverart_path / f"{row['slug']}.jpg"
                 additional_data["local_image_path"] = image_path
 
             yield (game, additional_data)
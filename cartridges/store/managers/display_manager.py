@@ -70,7 +70,7 @@ class DisplayManager(Manager):
                 shared.win.library.append(game)
             game.get_parent().set_focusable(False)
 
-        shared.win.set_library_child()
+        shared.win.schedule_set_library_child()
 
         if shared.win.get_application().state == shared.AppState.DEFAULT:
             shared.win.create_source_rows()
@@ -18,9 +18,11 @@
 #
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+from contextlib import closing
 from glob import escape
 from pathlib import Path
 from shutil import copyfile
+from sqlite3 import SQLITE_BUSY, SQLITE_LOCKED, Error, OperationalError, connect
 
 from gi.repository import GLib
 
@@ -31,7 +33,26 @@ def copy_db(original_path: Path) -> Path:
     The caller in in charge of deleting the returned path's parent dir.
     """
     tmp = Path(GLib.Dir.make_tmp())
-    for file in original_path.parent.glob(f"{escape(original_path.name)}*"):
-        copy = tmp / file.name
-        copyfile(str(file), str(copy))
-    return tmp / original_path.name
+    copy = tmp / original_path.name
+    busy_steps = 0
+
+    def check_busy(status: int, _remaining: int, _total: int) -> None:
+        # The backup retries forever while the app holds a write lock
+        nonlocal busy_steps
+        if status in (SQLITE_BUSY, SQLITE_LOCKED):
+            busy_steps += 1
+            if busy_steps >= 4:
+                raise OperationalError("database is locked")
+
+    # The backup API copies a consistent snapshot including the WAL and skips free pages
+    try:
+        with closing(
+            connect(f"{original_path.as_uri()}?mode=ro", uri=True, timeout=0)
+        ) as source, closing(connect(copy)) as destination:
+            source.backup(destination, progress=check_busy)
+    except Error:
+        # Opening a WAL database fails on read-only mounts without its -shm file
+        for file in original_path.parent.glob(f"{escape(original_path.name)}*"):
+            copyfile(str(file), str(tmp / file.name))
+
+    return copy
@@ -88,6 +88,18 @@ class CartridgesWindow(Adw.ApplicationWindow):
     sort_state: str = "last_played"
     filter_state: str = "all"
     source_rows: dict = {}
+    library_child_pending: bool = False
+    search_text: str = ""
+    hidden_search_text: str = ""
+
+    # The attribute to sort by and whether to sort in descending order
+    sort_orders: dict[str, tuple[str, bool]] = {
+        "a-z": ("sort_name", False),
+        "z-a": ("sort_name", True),
+        "newest": ("added", True),
+        "oldest": ("added", False),
+        "last_played": ("last_played", True),
+    }
 
     def create_source_rows(self) -> None:
         def get_removed(source_id: str) -> Any:
@@ -279,9 +291,29 @@ class CartridgesWindow(Adw.ApplicationWindow):
                 Gio.SettingsBindFlags.DEFAULT,
             )
 
-    def search_changed(self, _widget: Any, hidden: bool) -> None:
+    def search_changed(self, widget: Gtk.SearchEntry, hidden: bool) -> None:
         # Refresh search filter on keystroke in search box
-        (self.hidden_library if hidden else self.library).invalidate_filter()
+        text = widget.get_text().casefold()
+
+        if hidden:
+            self.hidden_search_text = text
+            self.hidden_library.invalidate_filter()
+        else:
+            self.search_text = text
+            self.library.invalidate_filter()
+
+    def schedule_set_library_child(self) -> None:
+        """Update the library placeholders once, after pending filtering is done"""
+        if self.library_child_pending:
+            return
+
+        self.library_child_pending = True
+        GLib.idle_add(self.__set_library_child_idle, priority=GLib.PRIORITY_LOW)
+
+    def __set_library_child_idle(self) -> bool:
+        self.library_child_pending = False
+        self.set_library_child()
+        return GLib.SOURCE_REMOVE
 
     def set_library_child(self) -> None:
         child, hidden_child = self.notice_empty, self.hidden_notice_empty
@@ -318,20 +350,9 @@ class CartridgesWindow(Adw.ApplicationWindow):
 
     def filter_func(self, child: Gtk.Widget) -> bool:
         game = child.get_child()
-        text = (
-            (
-                self.hidden_search_entry
-                if self.navigation_view.get_visible_page() == self.hidden_library_page
-                else self.search_entry
-            )
-            .get_text()
-            .lower()
-        )
-
-        filtered = text != "" and not (
-            text in game.name.lower()
-            or (text in game.developer.lower() if game.developer else False)
-        )
+        filtered = (
+            self.hidden_search_text if game.hidden else self.search_text
+        ) not in game.search_key
 
         if not filtered:
             if self.filter_state == "all":
@@ -340,7 +361,7 @@ class CartridgesWindow(Adw.ApplicationWindow):
                 filtered = True
 
         game.filtered = filtered
-        self.set_library_child()
+        self.schedule_set_library_child()
 
         return not filtered
 
@@ -412,26 +433,14 @@ class CartridgesWindow(Adw.ApplicationWindow):
         )
 
     def sort_func(self, child1: Gtk.Widget, child2: Gtk.Widget) -> int:
-        var, order = "name", True
+        var, order = self.sort_orders[self.sort_state]
+        game1, game2 = child1.get_child(), child2.get_child()
+        value1, value2 = getattr(game1, var), getattr(game2, var)
 
-        if self.sort_state in ("newest", "oldest"):
-            var, order = "added", self.sort_state == "newest"
-        elif self.sort_state == "last_played":
-            var = "last_played"
-        elif self.sort_state == "a-z":
-            order = False
+        if var != "sort_name" and value1 == value2:
+            value1, value2, order = game1.sort_name, game2.sort_name, False
 
-        def get_value(index: int) -> str:
-            return (
-                str(getattr((child1.get_child(), child2.get_child())[index], var))
-                .lower()
-                .removeprefix("the ")
-            )
-
-        if var != "name" and get_value(0) == get_value(1):
-            var, order = "name", False
-
-        return ((get_value(0) > get_value(1)) ^ order) * 2 - 1
+        return ((value1 > value2) ^ order) * 2 - 1
 
     def set_show_hidden(self, navigation_view: Adw.NavigationView, *_args: Any) -> None:
         self.lookup_action("show_hidden").set_enabled(
@@ -487,12 +496,10 @@ class CartridgesWindow(Adw.ApplicationWindow):
         )
         index = 0
 
-        while True:
-            if not (child := library.get_child_at_index(index)):
-                break
-
-            if self.filter_func(child):
-                self.show_details_page(child.get_child())
+        # Children are walked in sort order, the filter has already run on them
+        while child := library.get_child_at_index(index):
+            if not (game := child.get_child()).filtered:
+                self.show_details_page(game)
                 break
 
             index += 1